@@ -1,58 +1,195 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from flask_caching import Cache
+from flask.json.provider import JSONProvider
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import NamedTupleCursor, RealDictCursor
+from cachetools import TTLCache
 from werkzeug.security import check_password_hash
 from flask_bcrypt import Bcrypt
-from sync import sync_users_to_neo4j, sync_books_to_neo4j, sync_borrowed_to_neo4j, sync_inventory_to_neo4j
-from neo4j import GraphDatabase
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHash, VerificationError
+from db import execute_prepared, neo4j_conn, pg_conn
+from sync import mark_borrow_dirty, start_borrow_sync_worker
+import decimal
+import hmac
+import math
 import os
+import threading
+import time
+import orjson
+import redis
+
+def calibrate_bcrypt_rounds(target_seconds=0.25, samples=5):
+    """
+    Pick the bcrypt cost whose hash time on this host is closest to target_seconds.
+    Each extra round doubles the cost, so timings at cost 10 are enough to extrapolate; the
+    fastest of several is used because workers calibrate at once and contend for the CPU.
+    """
+    hasher = Bcrypt()
+    elapsed = float('inf')
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.generate_password_hash('calibration', rounds=10)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    rounds = max(10, min(16, 10 + round(math.log2(target_seconds / elapsed))))
+    print(f"Calibrated bcrypt cost {rounds}; set BCRYPT_ROUNDS={rounds} to pin it")
+    return rounds
+
+# Password hashing settings: BCRYPT_ROUNDS is a cost or "auto" to calibrate at startup,
+# PASSWORD_HASHER picks the scheme for new hashes ("bcrypt" or "argon2")
+BCRYPT_ROUNDS = os.getenv('BCRYPT_ROUNDS', '12')
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'bcrypt')
+
+class OrjsonProvider(JSONProvider):
+    """
+    Serve jsonify() responses through orjson, which encodes large row lists much faster
+    than the stdlib json module. Datetimes are written as ISO 8601 (naive ones as UTC).
+    """
+    @staticmethod
+    def _default(obj):
+        # Match Flask's default provider for the one non-native type our queries return
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default, option=orjson.OPT_NAIVE_UTC).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/*": {"origins": "http://localhost:4200"}})
+app.config['BCRYPT_LOG_ROUNDS'] = calibrate_bcrypt_rounds() if BCRYPT_ROUNDS == 'auto' else int(BCRYPT_ROUNDS)
 bcrypt = Bcrypt(app)
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Shared cache for the read-mostly endpoints; CACHE_TYPE=SimpleCache works without Redis in development
+cache = Cache(app, config={
+    "CACHE_TYPE": os.getenv('CACHE_TYPE', 'RedisCache'),
+    "CACHE_REDIS_URL": REDIS_URL,
+    "CACHE_DEFAULT_TIMEOUT": 60
+})
+# Raw client for caches that store ready-to-send response bodies
+redis_client = redis.Redis.from_url(REDIS_URL)
+# Recommendations only change when the user borrows, so they can live long
+RECOMMENDATIONS_TTL = 3600
+argon2_hasher = PasswordHasher()  # argon2-cffi defaults to Argon2id
+
+# Endpoints whose GET responses carry an ETag so clients can revalidate cheaply
+HTTP_CACHEABLE_ENDPOINTS = {'get_inventory', 'get_reviews', 'get_recommendations_endpoint'}
+
+@app.after_request
+def add_http_caching(response):
+    """
+    Tag cacheable GET responses with an ETag, answering 304 when the client's copy is current.
+    no-cache makes clients revalidate on every use, so a borrow/return/review shows up immediately.
+    """
+    if request.method == 'GET' and response.status_code == 200 and request.endpoint in HTTP_CACHEABLE_ENDPOINTS:
+        response.cache_control.no_cache = True
+        # Recommendations are per user, so only the user's own client may keep them
+        if request.endpoint == 'get_recommendations_endpoint':
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+def hash_password(password):
+    """
+    Hash a password with the configured scheme.
+    """
+    if PASSWORD_HASHER == 'argon2':
+        return argon2_hasher.hash(password)
+    return bcrypt.generate_password_hash(password).decode('utf-8')
 
-# PostgreSQL Database connection settings
-DB_HOST = os.getenv('DB_HOST', 'localhost')
-DB_NAME = os.getenv('DB_NAME', 'library')
-DB_USER = os.getenv('DB_USER', 'librarian')
-DB_PASS = os.getenv('DB_PASS', 'default_pass')  # default value for development
-DB_PORT = os.getenv('DB_PORT', '5432')
-
-# Neo4j connection settings
-NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
-NEO4J_USER = os.getenv('NEO4J_USER', 'neo4j')
-NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', 'default_neo4j_pass') 
-
-class Neo4jConnection:
-    def __init__(self, uri, user, password):
-        self._driver = GraphDatabase.driver(uri, auth=(user, password))
+def verify_password(password_hash, password):
+    """
+    Check a password against an Argon2 or bcrypt hash, dispatching on the hash prefix.
+    """
+    if password_hash.startswith('$argon2'):
+        try:
+            return argon2_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+    return bcrypt.check_password_hash(password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """
+    True when a stored hash uses a different scheme or a lower bcrypt cost than configured.
+    """
+    if password_hash.startswith('$argon2'):
+        # Never downgrade an Argon2 hash back to bcrypt
+        return PASSWORD_HASHER == 'argon2' and argon2_hasher.check_needs_rehash(password_hash)
+    if PASSWORD_HASHER == 'argon2':
+        return True
+    # bcrypt hashes look like $2b$<cost>$<salt+digest>. Only upgrade: with BCRYPT_ROUNDS=auto,
+    # workers can calibrate to neighbouring costs and would otherwise rewrite each other's hashes
+    return int(password_hash.split('$')[2]) < app.config['BCRYPT_LOG_ROUNDS']
+
+# Recently verified passwords, keyed by password hash, so repeat logins skip bcrypt.
+# Passwords are only stored as an HMAC under a per-process key; the cache lives in memory only.
+LOGIN_CACHE_KEY = os.urandom(32)
+verified_logins = TTLCache(maxsize=10_000, ttl=300)
+verified_logins_lock = threading.Lock()
+
+def make_dummy_hash():
+    """
+    Build the hash checked for unknown emails with the scheme and cost most stored hashes use.
+    Stored hashes only move to the configured settings as users log in, so hashing the dummy
+    with the configured settings would make unknown emails time differently during a migration.
+    Users on a less common scheme/cost still time differently until they are rehashed.
+    """
+    secret = os.urandom(16).hex()
+    try:
+        with pg_conn() as conn, conn.cursor() as cur:
+            # Group by scheme and cost: "$2b$10$" for bcrypt, "$argon2id$v=19$m=...,t=...,p=...$" for Argon2;
+            # ties go to the smallest hash so every worker picks the same sample
+            cur.execute("""
+                SELECT min(password_hash)
+                FROM "user"
+                WHERE password_hash LIKE '$2%' OR password_hash LIKE '$argon2%'
+                GROUP BY CASE WHEN password_hash LIKE '$argon2%'
+                              THEN substring(password_hash FROM '^(\\$[^$]+\\$[^$]+\\$[^$]+\\$)')
+                              ELSE left(password_hash, 7) END
+                ORDER BY COUNT(*) DESC, min(password_hash)
+                LIMIT 1
+            """)
+            row = cur.fetchone()
+        if row:
+            sample = row[0]
+            if sample.startswith('$argon2'):
+                return PasswordHasher.from_parameters(extract_parameters(sample)).hash(secret)
+            # bcrypt hashes look like $2b$<cost>$<salt+digest>
+            return bcrypt.generate_password_hash(secret, rounds=int(sample.split('$')[2])).decode('utf-8')
+    except Exception as e:
+        print(f"Error sampling stored password hashes: {e}")
+    return hash_password(secret)
 
-    def close(self):
-        self._driver.close()
+# Checked against when the email is unknown, so that path costs the same as a wrong password
+DUMMY_HASH = make_dummy_hash()
 
-    def run_query(self, query, params=None):
-        with self._driver.session() as session:
-            result = session.run(query, params)
-            # Consume the result into a list or process it directly
-            return [record for record in result]
+def check_password(password_hash, password):
+    """
+    verify_password with a short-lived cache of successful checks.
+    """
+    digest = hmac.new(LOGIN_CACHE_KEY, password.encode(), 'sha256').digest()
+    with verified_logins_lock:
+        cached_digest = verified_logins.get(password_hash)
+    if cached_digest is not None and hmac.compare_digest(cached_digest, digest):
+        return True
 
-# Singleton for Neo4j connection
-neo4j_conn = Neo4jConnection(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+    # Cache misses always pay the full hashing cost
+    if not verify_password(password_hash, password):
+        return False
 
-# Establish a connection to PostgreSQL
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            port=DB_PORT
-        )
-        return conn
-    except Exception as e:
-        print("Database connection failed:", str(e))
-        return None
+    with verified_logins_lock:
+        verified_logins[password_hash] = digest
+    return True
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -65,66 +202,67 @@ def login():
             return jsonify({"error": "Email and password are required"}), 400
 
         # Fetch the user from the database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, email, password_hash, role FROM \"user\" WHERE email = %s", (email,))
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
+        with pg_conn() as conn, conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_prepared(cur, "login_fetch",
+                             "SELECT id, email, password_hash, role FROM \"user\" WHERE email = $1", (email,))
+            user = cur.fetchone()
 
         if not user:
-            return jsonify({"error": "User not found"}), 404
+            # Burn the same hashing time as a real check so unknown emails can't be told apart
+            verify_password(DUMMY_HASH, password)
+            return jsonify({"error": "Invalid email or password"}), 401
 
-        user_id, user_email, password_hash, role = user
+        # Verify the password against the stored hash
+        if not check_password(user.password_hash, password):
+            return jsonify({"error": "Invalid email or password"}), 401
 
-        # Verify the password using bcrypt
-        if not bcrypt.check_password_hash(password_hash, password):
-            return jsonify({"error": "Invalid password"}), 401
+        # Upgrade the stored hash to the configured scheme/cost while we have the plaintext
+        if password_needs_rehash(user.password_hash):
+            with pg_conn() as conn, conn.cursor() as cur:
+                cur.execute("UPDATE \"user\" SET password_hash = %s WHERE id = %s",
+                            (hash_password(password), user.id))
+                conn.commit()
 
         # Successful login
         return jsonify({
             "message": "Login successful",
-            "user_id": user_id,
-            "role": role
+            "user_id": user.id,
+            "role": user.role
         }), 200
 
     except Exception as e:
         print(f"Error during login: {e}")
         return jsonify({"error": str(e)}), 500
 
-# API: Get Inventory
-@app.route('/inventory', methods=['GET'])
-def get_inventory():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
+@cache.memoize()
+def load_inventory():
+    """
+    Inventory rows for /inventory; cached until a borrow or return changes a quantity.
+    """
+    with pg_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        execute_prepared(cur, "inventory_list", """
             SELECT 
                 inventory.book_id, 
-                book.title, 
-                book.author, 
+                book.title AS title, 
+                book.author AS author, 
                 inventory.quantity 
             FROM inventory
             JOIN book ON inventory.book_id = book.id
         """)
-        inventory = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        inventory_list = []
-        for item in inventory:
-            inventory_list.append({
-                "book_id": item[0],
-                "title": item[1],
-                "author": item[2],
-                "quantity": item[3]
-            })
-
-        return jsonify({"inventory": inventory_list}), 200
+        return cur.fetchall()
+
+# API: Get Inventory
+@app.route('/inventory', methods=['GET'])
+def get_inventory():
+    try:
+        return jsonify({"inventory": load_inventory()}), 200
     except Exception as e:
         print(f"Error fetching inventory: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Advisory lock namespace for /borrow; the second key is the user id
+BORROW_LOCK_CLASS = 1
+
 # API: Borrow Book
 @app.route('/borrow', methods=['POST'])
 def borrow_book():
@@ -137,58 +275,66 @@ def borrow_book():
         if not user_id or not book_id or not due_date:
             return jsonify({"error": "User ID, Book ID, and Due Date are required"}), 400
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Check if the user has already borrowed this book
-        cur.execute("""
-            SELECT id FROM borrowed 
-            WHERE user_id = %s AND book_id = %s AND returned_date IS NULL
-        """, (user_id, book_id))
-        existing_borrow = cur.fetchone()
-        if existing_borrow:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "You have already borrowed this book"}), 400
-
-        # Check if the user has borrowed more than 4 books
-        cur.execute("""
-            SELECT COUNT(*) FROM borrowed 
-            WHERE user_id = %s AND returned_date IS NULL
-        """, (user_id,))
-        borrow_count = cur.fetchone()[0]
-        if borrow_count >= 4:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "You cannot borrow more than 4 books"}), 400
-
-        # Check inventory for book availability
-        cur.execute("SELECT quantity FROM inventory WHERE book_id = %s", (book_id,))
-        inventory = cur.fetchone()
-        if not inventory or inventory[0] <= 0:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Book is not available in inventory"}), 400
-
-        # Add borrow record
-        cur.execute(
-            """
-            INSERT INTO borrowed (user_id, book_id, due_date)
-            VALUES (%s, %s, %s) RETURNING id
-            """,
-            (user_id, book_id, due_date)
-        )
-        borrow_id = cur.fetchone()[0]
-
-        # Update inventory
-        cur.execute("UPDATE inventory SET quantity = quantity - 1 WHERE book_id = %s", (book_id,))
-
-        conn.commit()
-        cur.close()
-        conn.close()
-        # Sync borrowed records and inventory to Neo4j
-        sync_borrowed_to_neo4j()
-        sync_inventory_to_neo4j()
+        with pg_conn() as conn, conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            # Validate, decrement inventory and record the loan in one atomic statement.
+            # The inventory row lock keeps concurrent borrows from driving quantity below zero.
+            # The per-user advisory lock serializes a user's borrows so the 4-loan limit holds; it is
+            # a separate statement (sent in the same round-trip) because a CTE's snapshot is taken
+            # before any lock wait, so it would still count the loans as they were before the wait.
+            # The final SELECT always returns one row: borrow_id is NULL when a check failed, and the
+            # check results ride along so a rejection needs no second round-trip to explain.
+            try:
+                cur.execute("""
+                    SELECT pg_advisory_xact_lock(%(lock_class)s, %(user_id)s);
+                    WITH open_loans AS (
+                        SELECT book_id FROM borrowed
+                        WHERE user_id = %(user_id)s AND returned_date IS NULL
+                    ),
+                    dec AS (
+                        UPDATE inventory SET quantity = quantity - 1
+                        WHERE id = (
+                            -- a book may have several inventory rows; take a copy from one of them
+                            SELECT id FROM inventory
+                            WHERE book_id = %(book_id)s AND quantity > 0
+                            ORDER BY id LIMIT 1
+                            FOR UPDATE
+                        )
+                          AND quantity > 0
+                          AND (SELECT COUNT(*) FROM open_loans) < 4
+                          AND NOT EXISTS (SELECT 1 FROM open_loans WHERE book_id = %(book_id)s)
+                        RETURNING book_id
+                    ),
+                    ins AS (
+                        INSERT INTO borrowed (user_id, book_id, due_date)
+                        SELECT %(user_id)s, %(book_id)s, %(due_date)s FROM dec
+                        RETURNING id
+                    )
+                    SELECT
+                        (SELECT id FROM ins) AS borrow_id,
+                        EXISTS (SELECT 1 FROM open_loans WHERE book_id = %(book_id)s) AS existing_borrow,
+                        (SELECT COUNT(*) FROM open_loans) AS borrow_count
+                """, {"lock_class": BORROW_LOCK_CLASS, "user_id": user_id, "book_id": book_id, "due_date": due_date})
+                borrowed = cur.fetchone()
+            except psycopg2.errors.UniqueViolation:
+                # A concurrent request opened the same loan first
+                return jsonify({"error": "You have already borrowed this book"}), 400
+
+            if borrowed.borrow_id is None:
+                # Check if the user has already borrowed this book
+                if borrowed.existing_borrow:
+                    return jsonify({"error": "You have already borrowed this book"}), 400
+
+                # Check if the user has borrowed more than 4 books
+                if borrowed.borrow_count >= 4:
+                    return jsonify({"error": "You cannot borrow more than 4 books"}), 400
+
+                return jsonify({"error": "Book is not available in inventory"}), 400
+
+            conn.commit()
+        borrow_id = borrowed.borrow_id
+        cache.delete_memoized(load_inventory)
+        # Replicate the new borrowed record and inventory to Neo4j in the background
+        mark_borrow_dirty(user_id, book_id)
         return jsonify({"message": "Book borrowed successfully", "borrow_id": borrow_id}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -197,35 +343,23 @@ def borrow_book():
 @app.route('/borrowed/<int:user_id>', methods=['GET'])
 def get_borrowed_books(user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Fetch borrowed books for the given user_id
-        cur.execute("""
-            SELECT 
-                b.id AS book_id, 
-                b.title, 
-                b.author, 
-                br.due_date 
-            FROM borrowed br
-            JOIN book b ON br.book_id = b.id
-            WHERE br.user_id = %s AND br.returned_date IS NULL
-        """, (user_id,))
-        borrowed_books = cur.fetchall()
-
-        cur.close()
-        conn.close()
-
-        borrowed_books_list = []
-        for book in borrowed_books:
-            borrowed_books_list.append({
-                "book_id": book[0],
-                "title": book[1],
-                "author": book[2],
-                "due_date": book[3]
-            })
-
-        return jsonify({"borrowed_books": borrowed_books_list}), 200
+        with pg_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Fetch borrowed books for the given user_id; due_date is rendered as ISO 8601 text by the server.
+            # SET LOCAL renders timestamptz values in UTC for this read transaction only
+            cur.execute("SET LOCAL timezone = 'UTC'")
+            execute_prepared(cur, "borrowed_list", """
+                SELECT 
+                    b.id AS book_id, 
+                    b.title AS title, 
+                    b.author AS author, 
+                    to_json(br.due_date) #>> '{}' AS due_date 
+                FROM borrowed br
+                JOIN book b ON br.book_id = b.id
+                WHERE br.user_id = $1 AND br.returned_date IS NULL
+            """, (user_id,))
+            borrowed_books = cur.fetchall()
+
+        return jsonify({"borrowed_books": borrowed_books}), 200
     except Exception as e:
         print(f"Error fetching borrowed books: {e}")
         return jsonify({"error": str(e)}), 500
@@ -241,38 +375,34 @@ def return_book():
         if not user_id or not book_id:
             return jsonify({"error": "User ID and Book ID are required"}), 400
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Check if the user has borrowed the book
-        cur.execute("""
-            SELECT id FROM borrowed 
-            WHERE user_id = %s AND book_id = %s AND returned_date IS NULL
-        """, (user_id, book_id))
-        borrowed_record = cur.fetchone()
-
-        if not borrowed_record:
-            return jsonify({"error": "No borrowed record found for this user and book"}), 404
-
-        # Mark the book as returned
-        cur.execute("""
-            UPDATE borrowed 
-            SET returned_date = CURRENT_TIMESTAMP 
-            WHERE id = %s
-        """, (borrowed_record[0],))
-
-        # Update inventory
-        cur.execute("""
-            UPDATE inventory 
-            SET quantity = quantity + 1 
-            WHERE book_id = %s
-        """, (book_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
-        # Sync borrowed records and inventory to Neo4j
-        sync_borrowed_to_neo4j()
-        sync_inventory_to_neo4j()
+        with pg_conn() as conn, conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            # Check if the user has borrowed the book
+            cur.execute("""
+                SELECT id FROM borrowed 
+                WHERE user_id = %s AND book_id = %s AND returned_date IS NULL
+            """, (user_id, book_id))
+            borrowed_record = cur.fetchone()
+
+            if not borrowed_record:
+                return jsonify({"error": "No borrowed record found for this user and book"}), 404
+
+            # Mark the book as returned
+            cur.execute("""
+                UPDATE borrowed 
+                SET returned_date = CURRENT_TIMESTAMP 
+                WHERE id = %s
+            """, (borrowed_record.id,))
+
+            # Update inventory
+            cur.execute("""
+                UPDATE inventory 
+                SET quantity = quantity + 1 
+                WHERE book_id = %s
+            """, (book_id,))
+            conn.commit()
+        cache.delete_memoized(load_inventory)
+        # Replicate the returned record and inventory to Neo4j in the background
+        mark_borrow_dirty(user_id, book_id)
         return jsonify({"message": "Book returned successfully"}), 200
     except Exception as e:
         print(f"Error returning book: {e}")
@@ -290,49 +420,45 @@ def add_review():
         if not book_id or not user_id or not rating:
             return jsonify({"error": "Book ID, User ID, and Rating are required"}), 400
 
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with pg_conn() as conn, conn.cursor() as cur:
+            # Insert the review into the table
+            cur.execute("""
+                INSERT INTO review (book_id, user_id, rating, review_text)
+                VALUES (%s, %s, %s, %s)
+            """, (book_id, user_id, rating, review_text))
 
-        # Insert the review into the table
-        cur.execute("""
-            INSERT INTO review (book_id, user_id, rating, review_text)
-            VALUES (%s, %s, %s, %s)
-        """, (book_id, user_id, rating, review_text))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+        cache.delete_memoized(load_reviews, int(book_id))
 
         return jsonify({"message": "Review added successfully"}), 201
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/reviews/<int:book_id>', methods=['GET'])
-def get_reviews(book_id):
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Fetch reviews for the given book_id
+@cache.memoize()
+def load_reviews(book_id):
+    """
+    Reviews of one book for /reviews/<book_id>; cached until a review is added for it.
+    """
+    # Rows come back as dicts keyed by the column aliases below
+    with pg_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Fetch reviews for the given book_id; dates are rendered as ISO 8601 text by the server,
+        # with timestamptz values in UTC for this read transaction only
         cur.execute("""
-            SELECT r.id, r.rating, r.review_text, r.created_at, u.name AS user_name
+            SET LOCAL timezone = 'UTC';
+            SELECT r.id AS id, r.rating AS rating, r.review_text AS review_text,
+                   to_json(r.created_at) #>> '{}' AS created_at,
+                   u.name AS user_name
             FROM review r
             JOIN "user" u ON r.user_id = u.id
             WHERE r.book_id = %s
         """, (book_id,))
-        reviews = cur.fetchall()
+        return cur.fetchall()
 
-        cur.close()
-        conn.close()
-
-        # Format the results as JSON
-        review_list = [
-            {"id": row[0], "rating": row[1], "review_text": row[2], "created_at": row[3], "user_name": row[4]}
-            for row in reviews
-        ]
-
-        return jsonify({"reviews": review_list}), 200
+@app.route('/reviews/<int:book_id>', methods=['GET'])
+def get_reviews(book_id):
+    try:
+        return jsonify({"reviews": load_reviews(book_id)}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -340,24 +466,53 @@ def get_reviews(book_id):
 @app.route('/books/<int:book_id>/rating', methods=['GET'])
 def get_average_rating(book_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with pg_conn() as conn, conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            # Read the running totals maintained by the review trigger (migrations/002_book_rating.sql)
+            cur.execute("""
+                SELECT CASE WHEN num_reviews > 0 THEN sum_rating::float / num_reviews ELSE 0 END AS average_rating
+                FROM book_rating
+                WHERE book_id = %s
+            """, (book_id,))
+            row = cur.fetchone()
+
+        # Books without any reviews have no book_rating row
+        avg_rating = row.average_rating if row else 0
+        return jsonify({"average_rating": avg_rating}), 200
 
-        # Calculate average rating for the given book_id
-        cur.execute("""
-            SELECT AVG(rating) AS average_rating
-            FROM review
-            WHERE book_id = %s
-        """, (book_id,))
-        avg_rating = cur.fetchone()[0]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        cur.close()
-        conn.close()
+def load_recommendations(user_id):
+    """
+    Recommendations for /recommendations/<user_id>, straight from Neo4j.
+    """
+    query = """
+    MATCH (u:User {id: $user_id})-[:BORROWED]->(b:Book)-[:BELONGS_TO]->(g:Genre)<-[:BELONGS_TO]-(rec:Book)
+    WHERE NOT (u)-[:BORROWED]->(rec)
+    RETURN DISTINCT rec.title AS title, rec.author AS author, rec.year_published AS year
+    LIMIT 5
+    """
+    
+    # Run the query in Neo4j
+    recommendations = neo4j_conn.run_query(query, {"user_id": user_id})
+    
+    # Convert the results into a list of dictionaries
+    return [
+        {"title": record["title"], "author": record["author"], "year": record["year"]}
+        for record in recommendations
+    ]
 
-        return jsonify({"average_rating": avg_rating or 0}), 200
+def invalidate_recommendations(synced_borrows):
+    """
+    Drop cached recommendations of users whose borrows/returns have just reached Neo4j.
+    """
+    keys = {f"rec:{user_id}" for user_id, _ in synced_borrows}
+    try:
+        redis_client.delete(*keys)
+    except redis.RedisError as e:
+        print(f"Error invalidating cached recommendations: {e}")
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+start_borrow_sync_worker(on_synced=invalidate_recommendations)
 
 @app.route('/recommendations/<int:user_id>', methods=['GET'])
 def get_recommendations_endpoint(user_id):
@@ -365,24 +520,24 @@ def get_recommendations_endpoint(user_id):
     API endpoint to get book recommendations for a user based on their borrowing history.
     """
     try:
-        query = """
-        MATCH (u:User {id: $user_id})-[:BORROWED]->(b:Book)-[:BELONGS_TO]->(g:Genre)<-[:BELONGS_TO]-(rec:Book)
-        WHERE NOT (u)-[:BORROWED]->(rec)
-        RETURN DISTINCT rec.title AS title, rec.author AS author, rec.year_published AS year
-        LIMIT 5
-        """
-        
-        # Run the query in Neo4j
-        recommendations = neo4j_conn.run_query(query, {"user_id": user_id})
-        
-        # Convert the results into a list of dictionaries
-        result_list = [
-            {"title": record["title"], "author": record["author"], "year": record["year"]}
-            for record in recommendations
-        ]
-        
+        # Serve the cached, already-encoded body when there is one
+        cache_key = f"rec:{user_id}"
+        try:
+            cached = redis_client.get(cache_key)
+        except redis.RedisError as e:
+            print(f"Error reading cached recommendations: {e}")
+            cached = None
+        if cached is not None:
+            return cached, 200, {"Content-Type": "application/json"}
+
+        body = orjson.dumps({"recommendations": load_recommendations(user_id)})
+        try:
+            redis_client.setex(cache_key, RECOMMENDATIONS_TTL, body)
+        except redis.RedisError as e:
+            print(f"Error caching recommendations: {e}")
+
         # Return recommendations as JSON
-        return jsonify({"recommendations": result_list}), 200
+        return body, 200, {"Content-Type": "application/json"}
 
     except Exception as e:
         # Log the error and return a 500 response
@@ -390,4 +545,5 @@ def get_recommendations_endpoint(user_id):
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only; production runs under gunicorn via wsgi.py
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1')
\ No newline at end of file
@@ -0,0 +1,143 @@
+from neo4j import GraphDatabase
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from contextlib import contextmanager
+import os
+import threading
+
+# PostgreSQL Database connection settings
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'library')
+DB_USER = os.getenv('DB_USER', 'librarian')
+DB_PASS = os.getenv('DB_PASS', 'default_pass')  # default value for development
+DB_PORT = os.getenv('DB_PORT', '5432')
+# Pool bounds. DB_POOL_MIN connections are opened up front; more are opened on demand up to
+# DB_POOL_MAX per process, and every connection opened stays open once returned (see KeepingPool)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+# Seconds a request waits for a free pooled connection before failing
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+# Neo4j connection settings
+NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
+NEO4J_USER = os.getenv('NEO4J_USER', 'neo4j')
+NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', 'default_neo4j_pass') 
+
+class Neo4jConnection:
+    def __init__(self, uri, user, password):
+        # The driver keeps its own pool of bolt connections; sessions borrow from it
+        self._driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=50,
+            connection_acquisition_timeout=30
+        )
+
+    def close(self):
+        self._driver.close()
+
+    def run_query(self, query, params=None):
+        """
+        Run a read query in a managed transaction and return its records.
+        """
+        with self._driver.session() as session:
+            return session.execute_read(lambda tx: list(tx.run(query, params)))
+
+    def run_write_query(self, query, params=None):
+        """
+        Run a mutating query in a managed (retried) write transaction.
+        """
+        with self._driver.session() as session:
+            return session.execute_write(lambda tx: list(tx.run(query, params)))
+
+# Singleton for Neo4j connection, shared by the API and the sync jobs
+neo4j_conn = Neo4jConnection(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+
+class PreparingConnection(connection):
+    """
+    psycopg2 connection that remembers which statements it has PREPAREd on the server.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+def execute_prepared(cur, name, query, params=()):
+    """
+    Run query as the named server-side prepared statement so repeat calls skip parsing and planning.
+    The first call on a connection sends PREPARE and EXECUTE together, so it costs no extra
+    round-trip over a plain execute; pooled connections stay open (DB_POOL_MIN), so later
+    calls only send EXECUTE.
+    query uses $1, $2, ... placeholders; params fill them in order.
+    """
+    conn = cur.connection
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    if name in conn.prepared_statements:
+        cur.execute(execute, params)
+        return
+
+    # With params the whole string is interpolated, so literal % in the query must be escaped
+    prepare = f"PREPARE {name} AS {query.replace('%', '%%') if params else query}"
+    try:
+        cur.execute(f"{prepare}; {execute}", params)
+    except Exception:
+        # We can't tell whether the PREPARE took effect, so retire the connection
+        # (pg_conn() discards closed connections) rather than guess on the next call
+        conn.close()
+        raise
+    conn.prepared_statements.add(name)
+
+class KeepingPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that keeps every returned connection for reuse, up to maxconn.
+    psycopg2 closes a returned connection once minconn are idle, so a minconn below maxconn makes
+    busy workers reconnect constantly; raising minconn instead opens them all at import.
+    """
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # Only opening the pool uses minconn; past that it is the idle cap checked by putconn
+        self.minconn = maxconn
+
+# PostgreSQL connection pool, shared by all request handlers and sync jobs
+pg_pool = KeepingPool(
+    DB_POOL_MIN, DB_POOL_MAX,
+    connection_factory=PreparingConnection,
+    host=DB_HOST,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    port=DB_PORT
+)
+# ThreadedConnectionPool raises instead of waiting when all connections are out, so callers
+# queue here first. Under gevent this semaphore is monkey-patched and waits cooperatively,
+# which lets a worker accept more concurrent requests than it has connections.
+pg_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+@contextmanager
+def pg_conn():
+    """
+    Borrow a connection from the pool and hand it back when the block exits, however it exits.
+    Use as `with pg_conn() as conn, conn.cursor() as cur:` so the cursor is closed too.
+    """
+    if not pg_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"no PostgreSQL connection free after {DB_POOL_TIMEOUT}s")
+    try:
+        conn = pg_pool.getconn()
+    except Exception:
+        pg_pool_slots.release()
+        raise
+    try:
+        yield conn
+    finally:
+        # Early returns and errors can leave a transaction open; roll it back so the
+        # connection goes back to the pool clean
+        if not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error as e:
+                print(f"Error rolling back pooled connection: {e}")
+        try:
+            # Connections the server has dropped are discarded instead of being reused
+            pg_pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            pg_pool_slots.release()
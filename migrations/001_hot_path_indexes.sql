@@ -0,0 +1,17 @@
+-- Indexes backing the predicates used by the API's hot endpoints.
+-- Apply with: psql -d library -f migrations/001_hot_path_indexes.sql
+
+-- /login looks users up by email
+CREATE UNIQUE INDEX IF NOT EXISTS user_email_idx ON "user" (email);
+
+-- /borrow limit check and /borrowed/<user_id>: a user's open loans
+CREATE INDEX IF NOT EXISTS borrowed_open_user_idx ON borrowed (user_id) WHERE returned_date IS NULL;
+
+-- /borrow duplicate check and /return lookup; also stops a user holding two open loans of one book
+CREATE UNIQUE INDEX IF NOT EXISTS borrowed_open_user_book_idx ON borrowed (user_id, book_id) WHERE returned_date IS NULL;
+
+-- /borrow and /return inventory lookups
+CREATE INDEX IF NOT EXISTS inventory_book_idx ON inventory (book_id);
+
+-- /reviews/<book_id> and /books/<book_id>/rating
+CREATE INDEX IF NOT EXISTS review_book_idx ON review (book_id);
@@ -0,0 +1,48 @@
+-- Running per-book rating totals, kept current by a trigger on review,
+-- so /books/<book_id>/rating reads one row instead of aggregating every review.
+-- Apply with: psql -d library -f migrations/002_book_rating.sql
+
+-- Block review writes until the trigger and backfill commit together, so no
+-- review lands between the two and gets counted twice or not at all
+BEGIN;
+LOCK TABLE review IN SHARE MODE;
+
+CREATE TABLE IF NOT EXISTS book_rating (
+    book_id     INT PRIMARY KEY,
+    sum_rating  BIGINT NOT NULL DEFAULT 0,
+    num_reviews INT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION book_rating_apply(p_book_id INT, p_rating_delta BIGINT, p_count_delta INT)
+RETURNS void AS $$
+    INSERT INTO book_rating (book_id, sum_rating, num_reviews)
+    VALUES (p_book_id, p_rating_delta, p_count_delta)
+    ON CONFLICT (book_id) DO UPDATE
+    SET sum_rating = book_rating.sum_rating + EXCLUDED.sum_rating,
+        num_reviews = book_rating.num_reviews + EXCLUDED.num_reviews;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION book_rating_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM book_rating_apply(OLD.book_id, -OLD.rating, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM book_rating_apply(NEW.book_id, NEW.rating, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS review_book_rating ON review;
+CREATE TRIGGER review_book_rating
+AFTER INSERT OR UPDATE OF book_id, rating OR DELETE ON review
+FOR EACH ROW EXECUTE FUNCTION book_rating_sync();
+
+-- Backfill from the reviews that already exist
+INSERT INTO book_rating (book_id, sum_rating, num_reviews)
+SELECT book_id, SUM(rating), COUNT(*) FROM review GROUP BY book_id
+ON CONFLICT (book_id) DO UPDATE
+SET sum_rating = EXCLUDED.sum_rating, num_reviews = EXCLUDED.num_reviews;
+
+COMMIT;
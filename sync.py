@@ -1,47 +1,8 @@
-from neo4j import GraphDatabase
-import psycopg2
-import os
-
-# PostgreSQL Database connection settings
-DB_HOST = os.getenv('DB_HOST', 'localhost')
-DB_NAME = os.getenv('DB_NAME', 'library')
-DB_USER = os.getenv('DB_USER', 'librarian')
-DB_PASS = os.getenv('DB_PASS', 'default_pass')  # default value for development
-DB_PORT = os.getenv('DB_PORT', '5432')
-
-# Neo4j connection settings
-NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
-NEO4J_USER = os.getenv('NEO4J_USER', 'neo4j')
-NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', 'default_neo4j_pass') 
-
-# Initialize PostgreSQL connection
-def get_pg_connection():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            port=DB_PORT
-        )
-        return conn
-    except Exception as e:
-        print(f"Error connecting to PostgreSQL: {e}")
-        return None
-
-# Initialize Neo4j connection
-class Neo4jConnection:
-    def __init__(self, uri, user, password):
-        self._driver = GraphDatabase.driver(uri, auth=(user, password))
-
-    def close(self):
-        self._driver.close()
-
-    def run_query(self, query, params=None):
-        with self._driver.session() as session:
-            return session.run(query, params)
-
-neo4j_conn = Neo4jConnection(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+from contextlib import closing
+from db import neo4j_conn, pg_conn
+import atexit
+import queue
+import threading
 
 def delete_all_borrowed_from_neo4j():
     try:
@@ -49,136 +10,245 @@ def delete_all_borrowed_from_neo4j():
         MATCH (u:User)-[r:BORROWED]->(b:Book)
         DELETE r
         """
-        neo4j_conn.run_query(query)
+        neo4j_conn.run_write_query(query)
         print("Deleted all BORROWED relationships from Neo4j.")
     except Exception as e:
         print(f"Error deleting all BORROWED relationships: {e}")
         
+# Cypher upserts; each takes the full batch of rows as $rows so a sync is a single round-trip
+USER_UPSERT_QUERY = """
+UNWIND $rows AS row
+MERGE (u:User {id: row.id})
+SET u.name = row.name, u.email = row.email, u.role = row.role
+"""
+
+BOOK_UPSERT_QUERY = """
+UNWIND $rows AS row
+MERGE (b:Book {id: row.id})
+SET b.title = row.title, b.author = row.author, b.year_published = row.year_published, b.genre = row.genre
+"""
+
+BORROWED_UPSERT_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {id: row.user_id}), (b:Book {id: row.book_id})
+MERGE (u)-[r:BORROWED {id: row.id}]->(b)
+SET r.borrowed_date = row.borrowed_date, r.due_date = row.due_date, r.returned_date = row.returned_date
+"""
+
+INVENTORY_UPSERT_QUERY = """
+UNWIND $rows AS row
+MATCH (b:Book {id: row.book_id})
+MERGE (inv:Inventory {id: row.id})
+SET inv.quantity = row.quantity
+MERGE (b)-[:HAS_INVENTORY]->(inv)
+"""
+
+GENRE_UPSERT_QUERY = """
+UNWIND $rows AS row
+MERGE (g:Genre {name: row.genre})
+WITH g, row
+MATCH (b:Book {id: row.book_id})
+MERGE (b)-[:BELONGS_TO]->(g)
+"""
+
+# Rows per server-side cursor fetch and per UNWIND batch sent to Neo4j
+SYNC_BATCH_SIZE = 1000
+
+def fetch_in_batches(cursor_name, query):
+    """
+    Stream the rows of a query from a named (server-side) cursor, SYNC_BATCH_SIZE at a time,
+    so a sync never holds a whole table in memory.
+    The pool connection and its open transaction are held until the generator finishes,
+    including while the caller writes each batch to Neo4j; wrap it in contextlib.closing()
+    so an exception in the caller returns the connection right away.
+    """
+    with pg_conn() as conn, conn.cursor(name=cursor_name) as cur:
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(SYNC_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
 # Sync users
 def sync_users_to_neo4j():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, email, role FROM \"user\"")
-    users = cur.fetchall()
+    with closing(fetch_in_batches('sync_users', "SELECT id, name, email, role FROM \"user\"")) as batches:
+        for users in batches:
+            rows = [
+                {"id": user[0], "name": user[1], "email": user[2], "role": user[3]}
+                for user in users
+            ]
+            neo4j_conn.run_write_query(USER_UPSERT_QUERY, {"rows": rows})
 
-    for user in users:
-        query = """
-        MERGE (u:User {id: $id})
-        ON CREATE SET u.name = $name, u.email = $email, u.role = $role
-        ON MATCH SET u.name = $name, u.email = $email, u.role = $role
-        """
-        neo4j_conn.run_query(query, {"id": user[0], "name": user[1], "email": user[2], "role": user[3]})
-
-    cur.close()
-    conn.close()
     print("Users synced to Neo4j.")
 
 def sync_books_to_neo4j():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, author, year_published, genre FROM book")
-    books = cur.fetchall()
-
-    for book in books:
-        query = """
-        MERGE (b:Book {id: $id})
-        ON CREATE SET b.title = $title, b.author = $author, b.year_published = $year_published, b.genre = $genre
-        ON MATCH SET b.title = $title, b.author = $author, b.year_published = $year_published, b.genre = $genre
-        """
-        neo4j_conn.run_query(query, {"id": book[0], "title": book[1], "author": book[2], "year_published": book[3], "genre": book[4]})
+    with closing(fetch_in_batches('sync_books', "SELECT id, title, author, year_published, genre FROM book")) as batches:
+        for books in batches:
+            rows = [
+                {"id": book[0], "title": book[1], "author": book[2], "year_published": book[3], "genre": book[4]}
+                for book in books
+            ]
+            neo4j_conn.run_write_query(BOOK_UPSERT_QUERY, {"rows": rows})
 
-    cur.close()
-    conn.close()
     print("Books with genres synced to Neo4j.")
 
 def sync_borrowed_to_neo4j():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-
     # Select borrowed records
-    cur.execute("""
+    query = """
         SELECT DISTINCT ON (user_id, book_id) id, user_id, book_id, borrowed_date, due_date, returned_date
         FROM borrowed
         ORDER BY user_id, book_id, borrowed_date DESC
-    """)
-    borrowed_records = cur.fetchall()
+    """
+    with closing(fetch_in_batches('sync_borrowed', query)) as batches:
+        for borrowed_records in batches:
+            rows = [
+                {
+                    "id": record[0],
+                    "user_id": record[1],
+                    "book_id": record[2],
+                    "borrowed_date": record[3],
+                    "due_date": record[4],
+                    "returned_date": record[5]
+                }
+                for record in borrowed_records
+            ]
+            try:
+                neo4j_conn.run_write_query(BORROWED_UPSERT_QUERY, {"rows": rows})
+            except Exception as e:
+                print(f"Error syncing borrowed records {rows[0]['id']}..{rows[-1]['id']}: {e}")
 
-    for record in borrowed_records:
-        query = """
-        MATCH (u:User {id: $user_id}), (b:Book {id: $book_id})
-        MERGE (u)-[r:BORROWED {id: $id}]->(b)
-        ON CREATE SET r.borrowed_date = $borrowed_date, r.due_date = $due_date, r.returned_date = $returned_date
-        ON MATCH SET r.borrowed_date = $borrowed_date, r.due_date = $due_date, r.returned_date = $returned_date
-        """
+    print("Borrowed records synced to Neo4j.") 
+
+# Sync inventory
+def sync_inventory_to_neo4j():
+    with closing(fetch_in_batches('sync_inventory', "SELECT id, book_id, quantity FROM inventory")) as batches:
+        for inventory_records in batches:
+            rows = [
+                {"id": record[0], "book_id": record[1], "quantity": record[2]}
+                for record in inventory_records
+            ]
+            neo4j_conn.run_write_query(INVENTORY_UPSERT_QUERY, {"rows": rows})
+
+    print("Inventory synced to Neo4j.")
+
+def sync_genres_and_relationships():
+    # Fetch books with genres
+    query = "SELECT id, genre FROM book WHERE genre IS NOT NULL"
+    with closing(fetch_in_batches('sync_genres', query)) as batches:
+        for books_with_genres in batches:
+            # Create Genre nodes and relationships
+            rows = [{"book_id": book_id, "genre": genre} for book_id, genre in books_with_genres]
+            neo4j_conn.run_write_query(GENRE_UPSERT_QUERY, {"rows": rows})
+
+    print("Genres and relationships synced to Neo4j.")
+
+# Incremental sync of borrows/returns: request handlers mark (user_id, book_id) pairs dirty,
+# and a background thread replicates them every SYNC_INTERVAL_SECONDS in one batch
+SYNC_INTERVAL_SECONDS = 0.25
+dirty_borrows = queue.Queue()
+
+def mark_borrow_dirty(user_id, book_id):
+    """
+    Queue a (user_id, book_id) pair whose borrowed/inventory rows changed for replication to Neo4j.
+    """
+    dirty_borrows.put((int(user_id), int(book_id)))
+
+def flush_dirty_borrows(on_synced=None):
+    """
+    Drain the dirty set and replicate the current PostgreSQL state of those pairs to Neo4j.
+    Repeated changes to the same pair within a tick collapse into one row.
+    """
+    dirty = set()
+    while True:
         try:
-            # Run the query
-            neo4j_conn.run_query(query, {
+            dirty.add(dirty_borrows.get_nowait())
+        except queue.Empty:
+            break
+    if not dirty:
+        return
+
+    user_ids = [user_id for user_id, _ in dirty]
+    book_ids = [book_id for _, book_id in dirty]
+    try:
+        with pg_conn() as conn, conn.cursor() as cur:
+            # Latest borrow per pair only, matching what sync_borrowed_to_neo4j() replicates
+            cur.execute("""
+                SELECT DISTINCT ON (user_id, book_id) id, user_id, book_id, borrowed_date, due_date, returned_date
+                FROM borrowed
+                WHERE (user_id, book_id) IN (SELECT * FROM unnest(%s::int[], %s::int[]))
+                ORDER BY user_id, book_id, borrowed_date DESC
+            """, (user_ids, book_ids))
+            borrowed_records = cur.fetchall()
+            cur.execute("SELECT id, book_id, quantity FROM inventory WHERE book_id = ANY(%s)", (book_ids,))
+            inventory_records = cur.fetchall()
+
+        neo4j_conn.run_write_query(BORROWED_UPSERT_QUERY, {"rows": [
+            {
                 "id": record[0],
                 "user_id": record[1],
                 "book_id": record[2],
                 "borrowed_date": record[3],
                 "due_date": record[4],
                 "returned_date": record[5]
-            })
-        except Exception as e:
-            print(f"Error syncing record {record[0]}: {e}")
+            }
+            for record in borrowed_records
+        ]})
+        neo4j_conn.run_write_query(INVENTORY_UPSERT_QUERY, {"rows": [
+            {"id": record[0], "book_id": record[1], "quantity": record[2]}
+            for record in inventory_records
+        ]})
+    except Exception as e:
+        print(f"Error syncing {len(dirty)} borrowed records, will retry: {e}")
+        for key in dirty:
+            dirty_borrows.put(key)
+        return
 
-    cur.close()
-    conn.close()
-    print("Borrowed records synced to Neo4j.") 
+    if on_synced:
+        on_synced(dirty)
 
-# Sync inventory
-def sync_inventory_to_neo4j():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, book_id, quantity FROM inventory")
-    inventory_records = cur.fetchall()
+def start_borrow_sync_worker(on_synced=None):
+    """
+    Start the daemon thread that flushes dirty borrows; on_synced(pairs) runs after each successful flush.
+    Pending pairs are flushed once more at interpreter exit (gunicorn exits workers this way on SIGTERM).
+    """
+    stopping = threading.Event()
 
-    for record in inventory_records:
-        query = """
-        MATCH (b:Book {id: $book_id})
-        MERGE (inv:Inventory {id: $id})
-        ON CREATE SET inv.quantity = $quantity
-        ON MATCH SET inv.quantity = $quantity
-        MERGE (b)-[:HAS_INVENTORY]->(inv)
-        """
-        neo4j_conn.run_query(query, {"id": record[0], "book_id": record[1], "quantity": record[2]})
+    def run():
+        while not stopping.wait(SYNC_INTERVAL_SECONDS):
+            flush_dirty_borrows(on_synced)
 
-    cur.close()
-    conn.close()
-    print("Inventory synced to Neo4j.")
+    def shutdown():
+        stopping.set()
+        worker.join()
+        flush_dirty_borrows(on_synced)
 
-def sync_genres_and_relationships():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    
-    # Fetch books with genres
-    cur.execute("SELECT id, genre FROM book WHERE genre IS NOT NULL")
-    books_with_genres = cur.fetchall()
-    
-    for book in books_with_genres:
-        book_id, genre = book
+    worker = threading.Thread(target=run, name='neo4j-borrow-sync', daemon=True)
+    worker.start()
+    atexit.register(shutdown)
 
-        # Create Genre node and relationship
-        query = """
-        MERGE (g:Genre {name: $genre})
-        WITH g
-        MATCH (b:Book {id: $book_id})
-        MERGE (b)-[:BELONGS_TO]->(g)
-        """
-        neo4j_conn.run_query(query, {"genre": genre, "book_id": book_id})
-    
-    cur.close()
-    conn.close()
-    print("Genres and relationships synced to Neo4j.")
+def create_neo4j_indexes():
+    neo4j_conn.run_write_query("CREATE INDEX book_genre IF NOT EXISTS FOR (b:Book) ON (b.genre)")
+    print("Neo4j indexes created.")
 
 def create_similar_relationships():
+    # Pair books through their shared Genre node instead of comparing every pair of books;
+    # requires sync_genres_and_relationships() to have created the BELONGS_TO edges, and APOC
     query = """
-    MATCH (b1:Book), (b2:Book)
-    WHERE b1.genre = b2.genre AND b1.id <> b2.id
-    MERGE (b1)-[:SIMILAR_TO]->(b2)
+    CALL apoc.periodic.iterate(
+        "MATCH (g:Genre)<-[:BELONGS_TO]-(b1:Book) RETURN g, b1",
+        "MATCH (g)<-[:BELONGS_TO]-(b2:Book) WHERE b1.id <> b2.id MERGE (b1)-[:SIMILAR_TO]->(b2)",
+        {batchSize: 1000, parallel: false}
+    )
+    YIELD batches, failedBatches, errorMessages
+    RETURN batches, failedBatches, errorMessages
     """
-    neo4j_conn.run_query(query)
+    # apoc.periodic.iterate doesn't raise when batches fail; it reports them in its result row
+    result = neo4j_conn.run_write_query(query)[0]
+    if result["failedBatches"] > 0:
+        raise RuntimeError(
+            f"{result['failedBatches']} of {result['batches']} SIMILAR_TO batches failed: {result['errorMessages']}"
+        )
     print("SIMILAR_TO relationships created based on genre.")
 
 # Sync all data
@@ -189,8 +259,9 @@ def sync_all():
     sync_borrowed_to_neo4j()
    
     #sync_inventory_to_neo4j()
-    create_similar_relationships()
+    create_neo4j_indexes()
     sync_genres_and_relationships()
+    create_similar_relationships()
 
 # Entry point
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+# WSGI entry point for production:
+#   gunicorn -k gevent -w 4 --worker-connections 500 wsgi:app
+# Each worker opens at most DB_POOL_MAX PostgreSQL connections; greenlets beyond that wait
+# in db.pg_conn() for a free one (up to DB_POOL_TIMEOUT seconds).
+# Sockets must be patched before psycopg2, neo4j or Flask are imported.
+from gevent import monkey
+monkey.patch_all()
+
+# Make psycopg2 yield to other greenlets while waiting on PostgreSQL
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+from app import app